@@ -4,27 +4,193 @@ Lambda function for generating video clips using FFmpeg.
 Uses a public FFmpeg Lambda layer.
 """
 
-import json
 import os
 import subprocess
 import base64
-import urllib.request
+import concurrent.futures
+import io
 import uuid
-from typing import TypedDict
+
+import msgspec
+import orjson
+import urllib3
 
 # Supabase setup
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY')
 SUPABASE_BUCKET = 'clips'
 
+# Upload/public URL templates, formatted once per clip instead of
+# rebuilding the full f-string on every invocation
+_UPLOAD_URL_TMPL = f'{SUPABASE_URL}/storage/v1/object/{SUPABASE_BUCKET}/{{name}}'
+_PUBLIC_URL_TMPL = f'{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET}/{{name}}'
+
+# Shared pool so warm invocations reuse the TCP+TLS connection to
+# Supabase instead of paying a handshake per upload
+_HTTP = urllib3.PoolManager(num_pools=1, maxsize=4, retries=False)
+
+
+# Clips longer than the threshold are split into segments encoded by
+# parallel self-invocations, then concatenated with a stream copy.
+# Set FANOUT_THRESHOLD_SECONDS=0 to disable the fanout.
+FANOUT_THRESHOLD_SECONDS = float(os.environ.get('FANOUT_THRESHOLD_SECONDS', '0'))
+SEGMENT_SECONDS = float(os.environ.get('SEGMENT_SECONDS', '5'))
+
+# Synchronous Lambda invokes cap request and response payloads at 6 MB.
+# The chat image is forwarded to every segment invocation, so clips with
+# oversized screenshots must stay on the single-pass path; 5 MB leaves
+# headroom for the rest of the JSON envelope.
+_FANOUT_MAX_IMAGE_B64 = 5 * 1024 * 1024
+
+_lambda_client = None
+
+
+def _get_lambda_client():
+    global _lambda_client
+    if _lambda_client is None:
+        import boto3
+        _lambda_client = boto3.client('lambda')
+    return _lambda_client
+
+
+# Set USE_NVENC=1 on GPU deployments (e.g. the same image on ECS with a
+# g4dn instance); Lambda itself has no GPU so it stays off there
+USE_NVENC = os.environ.get('USE_NVENC') == '1'
+
+# Audio codec per recording_url, so repeated clips from the same
+# recording only probe once per warm container
+_audio_codec_cache: dict[str, str] = {}
+
+
+def probe_audio_codec(recording_url: str) -> str:
+    """Return the codec name of the first audio stream, '' if unknown."""
+    codec = _audio_codec_cache.get(recording_url)
+    if codec is None:
+        try:
+            result = subprocess.run(
+                [
+                    '/opt/bin/ffprobe', '-v', 'error',
+                    '-select_streams', 'a:0',
+                    '-show_entries', 'stream=codec_name',
+                    '-of', 'csv=p=0',
+                    recording_url
+                ],
+                capture_output=True,
+                text=True,
+                timeout=30
+            )
+            codec = result.stdout.strip() if result.returncode == 0 else ''
+        except Exception:
+            codec = ''
+        _audio_codec_cache[recording_url] = codec
+    return codec
+
+
+def build_video_cmd(image_path, recording_url, start_seconds, end_seconds,
+                    audio_args, output_path, use_nvenc=USE_NVENC):
+    """Build the single-pass FFmpeg command for a clip.
+
+    Slices the recording and muxes it with the looped chat image in one
+    process. -ss before -i uses input seeking, so the skipped prefix of
+    the recording is never decoded. The video track is a static image,
+    so it is encoded at 1 fps all-intra; h264_nvenc replaces libx264 on
+    hosts with a GPU.
+    """
+    if use_nvenc:
+        codec_args = [
+            '-c:v', 'h264_nvenc', '-preset', 'p1', '-tune', 'll',
+            '-rc', 'vbr', '-cq', '23',
+        ]
+    else:
+        codec_args = [
+            '-c:v', 'libx264', '-tune', 'stillimage', '-preset', 'ultrafast',
+            '-x264-params', 'keyint=1:min-keyint=1:scenecut=0',
+            '-threads', '0',
+        ]
+
+    return [
+        '/opt/bin/ffmpeg', '-y',
+        '-loop', '1', '-framerate', '1', '-i', image_path,
+        '-ss', str(start_seconds),
+        '-to', str(end_seconds),
+        # LiveKit egress writes faststart MP4s, so a shallow probe is
+        # enough to identify the AAC stream; skip the deep analysis and
+        # input buffering that otherwise delay startup on HTTP inputs
+        '-probesize', '32k', '-analyzeduration', '0', '-fflags', '+nobuffer',
+        '-i', recording_url,
+        '-avoid_negative_ts', 'make_zero',
+        '-map', '0:v', '-map', '1:a',
+        # Encode cost scales with pixel count; cap oversized screenshots
+        # at 1280px wide (kept even for yuv420p)
+        '-vf', "scale='trunc(min(1280,iw)/2)*2':-2",
+        *codec_args,
+        '-r', '1', '-g', '1', '-keyint_min', '1',
+        '-pix_fmt', 'yuv420p',
+        *audio_args,
+        '-shortest',
+        '-movflags', '+faststart',
+        output_path
+    ]
+
+
+def generate_segments_parallel(req, work_dir, start_seconds, end_seconds,
+                               function_name):
+    """Fan a long clip out to parallel self-invocations, one per segment.
 
-class ClipRequest(TypedDict):
+    Each sub-invocation renders [seg_start, seg_end) with the same
+    still-image pipeline and returns the MP4 as base64 (segments are
+    tiny at 1 fps all-intra). Returns the path to an FFmpeg concat list
+    of the segment files, which the caller stream-copies into the final
+    output.
+    """
+    bounds = []
+    t = start_seconds
+    while t < end_seconds:
+        bounds.append((t, min(t + SEGMENT_SECONDS, end_seconds)))
+        t += SEGMENT_SECONDS
+
+    client = _get_lambda_client()
+
+    def render(bound):
+        seg_start, seg_end = bound
+        payload = msgspec.structs.replace(
+            req, mode='segment',
+            start_seconds=seg_start, end_seconds=seg_end
+        )
+        response = client.invoke(
+            FunctionName=function_name,
+            Payload=msgspec.json.encode(payload)
+        )
+        result = orjson.loads(response['Payload'].read())
+        if 'segment_base64' not in result:
+            raise RuntimeError(
+                f'Segment {seg_start}-{seg_end} failed: {result}'
+            )
+        return base64.b64decode(result['segment_base64'])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(bounds)) as pool:
+        segments = list(pool.map(render, bounds))
+
+    list_path = f'{work_dir}/segments.txt'
+    with open(list_path, 'w') as f:
+        for i, segment in enumerate(segments):
+            segment_path = f'{work_dir}/segment_{i}.mp4'
+            with open(segment_path, 'wb') as seg_file:
+                seg_file.write(segment)
+            f.write(f"file '{segment_path}'\n")
+    return list_path
+
+
+class ClipRequest(msgspec.Struct):
+    """Clip request payload, decoded and validated in one msgspec pass."""
     recording_url: str
     start_seconds: float
     end_seconds: float
     chat_image_base64: str
     call_id: str
     exchange_index: int
+    # 'segment' for fanout sub-invocations, '' for client requests
+    mode: str = ''
 
 
 def handler(event, context):
@@ -49,70 +215,84 @@ def handler(event, context):
         return health(event, context)
 
     try:
-        # Parse request body
+        # Decode and validate the request body in a single msgspec pass
         if isinstance(event.get('body'), str):
-            body = json.loads(event['body'])
+            req = msgspec.json.decode(event['body'], type=ClipRequest)
         else:
-            body = event.get('body', event)
+            req = msgspec.convert(event.get('body', event), type=ClipRequest)
 
-        recording_url = body['recording_url']
-        start_seconds = float(body['start_seconds'])
-        end_seconds = float(body['end_seconds'])
-        chat_image_base64 = body['chat_image_base64']
-        call_id = body['call_id']
-        exchange_index = int(body['exchange_index'])
+        recording_url = req.recording_url
+        start_seconds = req.start_seconds
+        end_seconds = req.end_seconds
+        chat_image_base64 = req.chat_image_base64
+        call_id = req.call_id
+        exchange_index = req.exchange_index
 
-        # Create temp directory for processing
-        work_dir = f'/tmp/clip-{uuid.uuid4()}'
-        os.makedirs(work_dir, exist_ok=True)
+        # Create temp directory for processing; one uuid covers both the
+        # dir name and the uploaded file suffix
+        request_id = uuid.uuid4().hex
+        work_dir = f'/tmp/clip-{request_id}'
+        os.mkdir(work_dir)
 
         try:
             # Define paths
             image_path = f'{work_dir}/chat.png'
-            audio_path = f'{work_dir}/audio.m4a'
             output_path = f'{work_dir}/output.mp4'
 
-            # Save chat image
-            image_data = base64.b64decode(chat_image_base64)
+            # Save chat image, stream-decoding the base64 straight to
+            # disk so the decoded bytes are never held in memory whole.
+            # Frontends sometimes send a full data URL; strip the prefix.
+            if chat_image_base64.startswith('data:'):
+                chat_image_base64 = chat_image_base64.split(',', 1)[1]
             with open(image_path, 'wb') as f:
-                f.write(image_data)
+                base64.decode(io.BytesIO(chat_image_base64.encode('ascii')), f)
 
-            # Slice recording using FFmpeg
-            duration = end_seconds - start_seconds
-            slice_cmd = [
-                '/opt/bin/ffmpeg', '-y',
-                '-ss', str(start_seconds),
-                '-i', recording_url,
-                '-t', str(duration),
-                '-c:a', 'aac', '-b:a', '192k',
-                audio_path
-            ]
+            # Stream-copy the audio when the recording is already AAC
+            # (the default from LiveKit egress) instead of paying a full
+            # decode + re-encode; fall back to re-encoding otherwise
+            if probe_audio_codec(recording_url) == 'aac':
+                audio_args = ['-c:a', 'copy']
+            else:
+                audio_args = ['-c:a', 'aac', '-b:a', '192k']
 
-            result = subprocess.run(
-                slice_cmd,
-                capture_output=True,
-                text=True,
-                timeout=120
+            is_segment = req.mode == 'segment'
+            duration = end_seconds - start_seconds
+            function_name = getattr(context, 'function_name', None)
+            use_fanout = (
+                not is_segment
+                and FANOUT_THRESHOLD_SECONDS > 0
+                and duration > FANOUT_THRESHOLD_SECONDS
+                and function_name
+                and len(req.chat_image_base64) <= _FANOUT_MAX_IMAGE_B64
             )
 
-            if result.returncode != 0:
-                return {
-                    'statusCode': 500,
-                    'body': json.dumps({
-                        'error': f'FFmpeg slice failed: {result.stderr}'
-                    })
-                }
+            video_cmd = None
+            if use_fanout:
+                # Render segments in parallel workers, then stream-copy
+                # concat them (near-free; every segment starts on a
+                # keyframe since the encode is all-intra)
+                try:
+                    list_path = generate_segments_parallel(
+                        req, work_dir, start_seconds, end_seconds, function_name
+                    )
+                    video_cmd = [
+                        '/opt/bin/ffmpeg', '-y',
+                        '-f', 'concat', '-safe', '0', '-i', list_path,
+                        '-c', 'copy',
+                        '-movflags', '+faststart',
+                        output_path
+                    ]
+                except Exception as fanout_error:
+                    # The fanout is only an optimization; render the
+                    # clip in one pass rather than failing it
+                    print(f'Segment fanout failed, falling back to single pass: {fanout_error}')
 
-            # Generate video combining image + audio
-            video_cmd = [
-                '/opt/bin/ffmpeg', '-y',
-                '-loop', '1', '-i', image_path,
-                '-i', audio_path,
-                '-c:v', 'libx264', '-tune', 'stillimage', '-pix_fmt', 'yuv420p',
-                '-c:a', 'aac', '-b:a', '192k',
-                '-shortest',
-                output_path
-            ]
+            if video_cmd is None:
+                video_cmd = build_video_cmd(
+                    image_path, recording_url,
+                    start_seconds, end_seconds,
+                    audio_args, output_path
+                )
 
             result = subprocess.run(
                 video_cmd,
@@ -124,43 +304,49 @@ def handler(event, context):
             if result.returncode != 0:
                 return {
                     'statusCode': 500,
-                    'body': json.dumps({
+                    'body': orjson.dumps({
                         'error': f'FFmpeg video generation failed: {result.stderr}'
-                    })
+                    }).decode()
                 }
 
-            # Read the output video
-            with open(output_path, 'rb') as f:
-                video_data = f.read()
+            # Segment sub-invocations hand the MP4 back to the parent
+            # instead of uploading
+            if is_segment:
+                with open(output_path, 'rb') as f:
+                    return {
+                        'segment_base64': base64.b64encode(f.read()).decode()
+                    }
 
-            # Upload to Supabase Storage
-            file_name = f'{call_id}_{exchange_index}_{uuid.uuid4().hex[:8]}.mp4'
-            upload_url = f'{SUPABASE_URL}/storage/v1/object/{SUPABASE_BUCKET}/{file_name}'
+            # Upload to Supabase Storage, streaming from disk so the MP4
+            # is never held in memory as a whole
+            file_name = f'{call_id}_{exchange_index}_{request_id[:8]}.mp4'
+            upload_url = _UPLOAD_URL_TMPL.format(name=file_name)
 
-            req = urllib.request.Request(
-                upload_url,
-                data=video_data,
-                headers={
-                    'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
-                    'Content-Type': 'video/mp4',
-                },
-                method='POST'
-            )
+            with open(output_path, 'rb') as video_file:
+                response = _HTTP.request(
+                    'POST',
+                    upload_url,
+                    body=video_file,
+                    headers={
+                        'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
+                        'Content-Type': 'video/mp4',
+                        'Content-Length': str(os.path.getsize(output_path)),
+                    },
+                    timeout=60.0
+                )
 
-            try:
-                with urllib.request.urlopen(req, timeout=60) as response:
-                    upload_result = json.loads(response.read().decode())
-            except urllib.error.HTTPError as e:
-                error_body = e.read().decode()
+            if response.status >= 400:
                 return {
                     'statusCode': 500,
-                    'body': json.dumps({
-                        'error': f'Supabase upload failed: {e.code} {error_body}'
-                    })
+                    'body': orjson.dumps({
+                        'error': f'Supabase upload failed: {response.status} {response.data.decode()}'
+                    }).decode()
                 }
 
+            upload_result = orjson.loads(response.data)
+
             # Get public URL
-            public_url = f'{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET}/{file_name}'
+            public_url = _PUBLIC_URL_TMPL.format(name=file_name)
 
             return {
                 'statusCode': 200,
@@ -168,22 +354,31 @@ def handler(event, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
+                'body': orjson.dumps({
                     'clipUrl': public_url
-                })
+                }).decode()
             }
 
         finally:
-            # Cleanup work directory
-            import shutil
-            shutil.rmtree(work_dir, ignore_errors=True)
+            # Cleanup work directory (always flat: image, output and any
+            # segment files, so no recursive walk needed)
+            try:
+                with os.scandir(work_dir) as entries:
+                    for entry in entries:
+                        try:
+                            os.unlink(entry.path)
+                        except OSError:
+                            pass
+                os.rmdir(work_dir)
+            except OSError:
+                pass
 
     except Exception as e:
         return {
             'statusCode': 500,
-            'body': json.dumps({
+            'body': orjson.dumps({
                 'error': str(e)
-            })
+            }).decode()
         }
 
 
@@ -203,8 +398,8 @@ def health(event, context):
 
     return {
         'statusCode': 200,
-        'body': json.dumps({
+        'body': orjson.dumps({
             'status': 'healthy',
             'ffmpeg_available': ffmpeg_available
-        })
+        }).decode()
     }
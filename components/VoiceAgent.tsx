@@ -518,23 +518,32 @@ export default function VoiceAgent() {
                     const data = JSON.parse(new TextDecoder().decode(payload));
                     console.log("DataReceived:", data.type, data);
 
-                    if (data.type === 'transcript' && data.text) {
+                    const applyTranscriptEntry = (item: any) => {
                         // Store timestamped entry for video clip feature
                         const entry: TranscriptEntry = {
-                            speaker: data.speaker as 'user' | 'agent',
-                            text: data.text,
-                            startSeconds: data.startSeconds ?? 0,
-                            endSeconds: data.endSeconds ?? 0,
+                            speaker: item.speaker as 'user' | 'agent',
+                            text: item.text,
+                            startSeconds: item.startSeconds ?? 0,
+                            endSeconds: item.endSeconds ?? 0,
                         };
                         timestampedTranscriptRef.current.push(entry);
 
                         // Update display transcript
-                        const speaker = data.speaker === 'agent' ? 'Doc' : 'You';
-                        const formattedLine = `${speaker}: ${data.text}`;
+                        const speaker = item.speaker === 'agent' ? 'Doc' : 'You';
+                        const formattedLine = `${speaker}: ${item.text}`;
                         if (!fullTranscriptRef.current.includes(formattedLine)) {
                             fullTranscriptRef.current.push(formattedLine);
                             setTranscript((prev) => [...prev.slice(-6), formattedLine]);
                         }
+                    };
+
+                    if (data.type === 'transcript' && data.text) {
+                        applyTranscriptEntry(data);
+                    } else if (data.type === 'transcript_batch' && Array.isArray(data.entries)) {
+                        // Agent coalesces bursts of entries into one publish
+                        for (const item of data.entries) {
+                            if (item.text) applyTranscriptEntry(item);
+                        }
                     } else if (data.type === 'transcript_complete' && data.entries) {
                         // Final transcript from agent on disconnect - use this if we missed any
                         console.log("Received complete transcript with", data.entries.length, "entries");
@@ -1,8 +1,10 @@
-import json
+import gzip
 import logging
 import os
 import time
 import asyncio
+
+import orjson
 from dotenv import load_dotenv
 
 from livekit import agents, rtc, api
@@ -19,6 +21,28 @@ load_dotenv()
 
 logger = logging.getLogger("doc-agent")
 
+_s3_client = None
+
+
+def _get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client("s3", region_name=S3_REGION)
+    return _s3_client
+
+
+def upload_transcript_to_s3(key: str, body: bytes):
+    """Blocking S3 put; run via asyncio.to_thread from the event loop."""
+    _get_s3_client().put_object(
+        Bucket=S3_BUCKET,
+        Key=key,
+        Body=body,
+        ContentEncoding="gzip",
+        ContentType="application/json",
+    )
+
+
 # Track session start time for relative timestamps
 session_start_time: float = 0
 transcript_entries: list = []
@@ -139,6 +163,16 @@ class DocAssistant(Agent):
         super().__init__(instructions=DOC_PERSONA)
 
 
+def prewarm(proc: agents.JobProcess):
+    """Load the Silero VAD model once per worker process.
+
+    VAD.load() deserializes the ONNX model from disk; doing it here
+    instead of in entrypoint means new rooms reuse the cached model
+    rather than paying the load on every session.
+    """
+    proc.userdata["vad"] = silero.VAD.load()
+
+
 async def entrypoint(ctx: agents.JobContext):
     """Main entry point for the voice agent."""
     global session_start_time, transcript_entries
@@ -147,10 +181,9 @@ async def entrypoint(ctx: agents.JobContext):
 
     await ctx.connect()
 
-    # Start recording the room to S3
-    egress_id = await start_room_recording(ctx.room.name)
-    if egress_id:
-        logger.info(f"Recording started with egress_id: {egress_id}")
+    # Kick the S3 recording request off in the background so its API
+    # round-trip overlaps the STT/TTS handshakes in session.start
+    egress_task = asyncio.create_task(start_room_recording(ctx.room.name))
 
     # Initialize session timing
     session_start_time = time.time()
@@ -163,25 +196,40 @@ async def entrypoint(ctx: agents.JobContext):
             voice_id="pNInz6obpgDQGcFmaJgB",  # Adam - warm, conversational male voice
             model="eleven_turbo_v2_5",
         ),
-        vad=silero.VAD.load(),
+        vad=ctx.proc.userdata["vad"],
     )
 
-    # Helper to broadcast transcript updates to the room
-    async def broadcast_transcript(speaker: str, text: str, start_time: float, end_time: float):
-        """Send transcript entry to all participants via data channel."""
-        entry = {
-            "type": "transcript",
-            "speaker": speaker,  # "user" or "agent"
-            "text": text,
-            "startSeconds": start_time,
-            "endSeconds": end_time,
-        }
-        transcript_entries.append(entry)
+    # Transcript entries are queued and flushed by a single background
+    # coroutine, so a burst of items becomes one reliable-channel publish
+    # instead of one round-trip per item
+    transcript_queue: asyncio.Queue = asyncio.Queue()
+
+    async def transcript_flusher():
+        """Drain queued transcript entries and publish them as one batch."""
+        while True:
+            entries = [await transcript_queue.get()]
+            # Brief debounce so items arriving together coalesce
+            await asyncio.sleep(0.05)
+            while True:
+                try:
+                    entries.append(transcript_queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            batch = {
+                "type": "transcript_batch",
+                "entries": entries,
+            }
+            try:
+                await ctx.room.local_participant.publish_data(
+                    orjson.dumps(batch),
+                    reliable=True
+                )
+            except Exception as e:
+                logger.warning(f"Could not publish transcript batch: {e}")
+            logger.debug(f"Published transcript batch of {len(entries)} entries")
 
-        # Broadcast to room
-        data = json.dumps(entry).encode()
-        await ctx.room.local_participant.publish_data(data, reliable=True)
-        logger.debug(f"Transcript: [{speaker}] {text[:50]}... ({start_time:.2f}s - {end_time:.2f}s)")
+    flusher_task = asyncio.create_task(transcript_flusher())
 
     # Capture transcripts from conversation_item_added events
     @session.on("conversation_item_added")
@@ -200,8 +248,16 @@ async def entrypoint(ctx: agents.JobContext):
         speaker = "user" if role == "user" else "agent"
         logger.info(f"Conversation item: [{speaker}] {content[:100]}... ({start_seconds:.2f}s - {end_seconds:.2f}s)")
 
-        # Broadcast to frontend
-        asyncio.create_task(broadcast_transcript(speaker, content, start_seconds, end_seconds))
+        # Queue for the batched broadcast to the frontend
+        entry = {
+            "type": "transcript",
+            "speaker": speaker,  # "user" or "agent"
+            "text": content,
+            "startSeconds": start_seconds,
+            "endSeconds": end_seconds,
+        }
+        transcript_entries.append(entry)
+        transcript_queue.put_nowait(entry)
 
     await session.start(
         room=ctx.room,
@@ -213,32 +269,61 @@ async def entrypoint(ctx: agents.JobContext):
         instructions="Greet the user with: Hey. Long day? I've got nowhere to be if you need to vent about the latest circle of healthcare hell."
     )
 
-    # When session ends, send final transcript summary
+    egress_id = await egress_task
+    if egress_id:
+        logger.info(f"Recording started with egress_id: {egress_id}")
+
+    # When session ends, persist the full transcript to S3 and send a
+    # pointer over the data channel
     @ctx.room.on("disconnected")
     def on_room_disconnected():
         logger.info(f"Room disconnected. Total transcript entries: {len(transcript_entries)}")
-        # Send final transcript as room metadata or final data message
-        final_data = {
-            "type": "transcript_complete",
-            "entries": transcript_entries,
-            "totalDuration": time.time() - session_start_time,
-        }
+        flusher_task.cancel()
+
+        transcript_key = f"transcripts/{ctx.room.name}.json.gz"
+        total_duration = time.time() - session_start_time
+
+        async def finalize_transcript():
+            # S3 is still reachable while the room tears down; the data
+            # channel often is not, so the full blob goes there
+            try:
+                compressed = gzip.compress(
+                    orjson.dumps({
+                        "entries": transcript_entries,
+                        "totalDuration": total_duration,
+                    }),
+                    compresslevel=1,
+                )
+                await asyncio.to_thread(
+                    upload_transcript_to_s3, transcript_key, compressed
+                )
+                logger.info(f"Transcript uploaded to s3://{S3_BUCKET}/{transcript_key}")
+            except Exception as e:
+                logger.warning(f"Could not upload transcript to S3: {e}")
 
-        async def send_final_transcript():
+            # Best-effort final message; entries stay inline since the
+            # frontend consumes them directly, with the S3 key alongside
+            # for anything that wants the durable copy
             try:
                 await ctx.room.local_participant.publish_data(
-                    json.dumps(final_data).encode(),
+                    orjson.dumps({
+                        "type": "transcript_complete",
+                        "entries": transcript_entries,
+                        "transcriptKey": transcript_key,
+                        "totalDuration": total_duration,
+                    }),
                     reliable=True
                 )
             except Exception as e:
                 logger.warning(f"Could not send final transcript: {e}")
 
-        asyncio.create_task(send_final_transcript())
+        asyncio.create_task(finalize_transcript())
 
 
 if __name__ == "__main__":
     agents.cli.run_app(
         agents.WorkerOptions(
             entrypoint_fnc=entrypoint,
+            prewarm_fnc=prewarm,
         ),
     )
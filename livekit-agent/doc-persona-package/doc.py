@@ -36,6 +36,35 @@ What you DON'T do: Toxic positivity, suggest they "just" do anything, defend the
 Keep responses concise and conversational. No emojis, no asterisks."""
 
 
+# Compact the conversation once it grows past this many entries,
+# keeping the most recent ones verbatim
+COMPACT_THRESHOLD = 20
+COMPACT_KEEP_RECENT = 10
+
+
+def compact_conversation(client: OpenAI, conversation: list) -> list:
+    """Summarize older turns so the prompt stays bounded in long sessions.
+
+    Every ask_doc call re-sends the whole history, so without this the
+    prompt (and per-turn latency) grows with every exchange. Older
+    entries get collapsed into one summary message; the last few turns
+    stay verbatim.
+    """
+    if len(conversation) <= COMPACT_THRESHOLD:
+        return conversation
+
+    older = conversation[:-COMPACT_KEEP_RECENT]
+    recent = conversation[-COMPACT_KEEP_RECENT:]
+    summary = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Summarize the prior conversation tersely, preserving emotional context."},
+            *older,
+        ]
+    ).choices[0].message.content
+    return [{"role": "system", "content": f"Earlier in this conversation: {summary}"}] + recent
+
+
 def get_client() -> OpenAI:
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
@@ -44,8 +73,13 @@ def get_client() -> OpenAI:
     return OpenAI(api_key=api_key)
 
 
-def ask_doc(client: OpenAI, message: str, conversation: list = None) -> str:
-    """Send a message to Doc and get a response."""
+def ask_doc(client: OpenAI, message: str, conversation: list = None, stream: bool = False) -> str:
+    """Send a message to Doc and get a response.
+
+    With stream=True, tokens are printed as they arrive (so the user
+    sees the reply at first-token latency) and the full text is still
+    returned for conversation history.
+    """
     if conversation is None:
         conversation = []
 
@@ -53,18 +87,32 @@ def ask_doc(client: OpenAI, message: str, conversation: list = None) -> str:
     messages.extend(conversation)
     messages.append({"role": "user", "content": message})
 
-    response = client.chat.completions.create(
+    if not stream:
+        response = client.chat.completions.create(
+            model="gpt-4o",
+            temperature=0.9,
+            messages=messages
+        )
+        return response.choices[0].message.content
+
+    pieces = []
+    for chunk in client.chat.completions.create(
         model="gpt-4o",
         temperature=0.9,
-        messages=messages
-    )
-    return response.choices[0].message.content
+        messages=messages,
+        stream=True
+    ):
+        if chunk.choices and chunk.choices[0].delta.content:
+            piece = chunk.choices[0].delta.content
+            pieces.append(piece)
+            print(piece, end="", flush=True)
+    return "".join(pieces)
 
 
-def respond_to_tweet(client: OpenAI, tweet: str) -> str:
+def respond_to_tweet(client: OpenAI, tweet: str, stream: bool = False) -> str:
     """Generate a Doc-style response to a physician's tweet."""
     prompt = f"A physician just posted this on social media. Respond as Doc would—with dark humor, validation, and zero toxic positivity:\n\n\"{tweet}\""
-    return ask_doc(client, prompt)
+    return ask_doc(client, prompt, stream=stream)
 
 
 def interactive_mode(client: OpenAI):
@@ -94,15 +142,16 @@ def interactive_mode(client: OpenAI):
             print("Take care of yourself out there.")
             break
 
+        print("\nDoc: ", end="", flush=True)
         if user_input.lower().startswith("/tweet "):
             tweet = user_input[7:].strip()
-            response = respond_to_tweet(client, tweet)
+            respond_to_tweet(client, tweet, stream=True)
         else:
-            response = ask_doc(client, user_input, conversation)
+            response = ask_doc(client, user_input, conversation, stream=True)
             conversation.append({"role": "user", "content": user_input})
             conversation.append({"role": "assistant", "content": response})
-
-        print(f"\nDoc: {response}\n")
+            conversation = compact_conversation(client, conversation)
+        print("\n")
 
 
 def main():